@@ -0,0 +1,131 @@
+#!/usr/bin/python3.9
+
+"""
+This script estimates how far the sample clock of a sound card drifts
+from its nominal sample rate and corrects recordings for it. pyaud.py
+feeds the estimator the number of frames received after every read
+together with the monotonic clock, and the real sample rate is the slope
+of a least squares fit of frames against time. Cheap USB interfaces are
+often tens of ppm off, which adds up to seconds over a multi-day
+deployment.
+"""
+
+
+# Reads during the first WARMUP_SECONDS of a stream are ignored, as PortAudio delivers them in bursts
+WARMUP_SECONDS = 0.5
+
+# Estimates further than this from the nominal rate are treated as measurement errors (e.g. dropped buffers)
+MAX_PLAUSIBLE_PPM = 1000
+
+# Number of output samples resampled at a time. Only the int16 output is allocated at full length,
+# the float64 temporaries of the interpolation are limited to a few MB per chunk.
+RESAMPLE_CHUNK = 1 << 16
+
+
+# Estimates the real sample rate of one input stream from (monotonic time, frames received) pairs
+class ClockDriftEstimator(object):
+    def __init__(self, nominal_rate, warmup_seconds=WARMUP_SECONDS):
+        self.nominal_rate = nominal_rate
+        self.warmup_seconds = warmup_seconds
+        self.first_time = None
+
+        # Running means and centred sums of squares / products of the least squares fit
+        self.count = 0
+        self.mean_time = 0.0
+        self.mean_frames = 0.0
+        self.sxx = 0.0
+        self.sxy = 0.0
+
+    # Adds a point: timestamp from time.monotonic() and the total number of frames received so far
+    def update(self, timestamp, total_frames):
+        if self.first_time is None:
+            self.first_time = timestamp
+        elapsed = timestamp - self.first_time
+        if elapsed < self.warmup_seconds:
+            return
+
+        # Welford style update, which stays accurate over days of data
+        self.count += 1
+        dx = elapsed - self.mean_time
+        self.mean_time += dx / self.count
+        self.mean_frames += (total_frames - self.mean_frames) / self.count
+        self.sxx += dx * (elapsed - self.mean_time)
+        self.sxy += dx * (total_frames - self.mean_frames)
+
+    # Measured sample rate in Hz, or None if there is not enough data yet
+    @property
+    def rate(self):
+        return combined_rate([self])
+
+    # Difference between the measured and nominal sample rate in parts per million
+    @property
+    def drift_ppm(self):
+        return rate_to_ppm(self.rate, self.nominal_rate)
+
+    # Monotonic time at which total_frames had been received according to the fit, or None without a fit.
+    # time_at_frames(0) is when capture of the first frame started. rate can be given to extrapolate with
+    # a less noisy estimate, e.g. the one pooled over the session.
+    def time_at_frames(self, total_frames, rate=None):
+        if rate is None:
+            rate = self.rate
+        if rate is None or self.count == 0:
+            return None
+        return self.first_time + self.mean_time + (total_frames - self.mean_frames) / rate
+
+
+# Sample rate measured over several streams of the same device, e.g. all recordings of a session.
+# Each stream keeps its own offset, so the slopes are pooled rather than fitting one line through all points.
+def combined_rate(estimators):
+    sxx = sum(e.sxx for e in estimators)
+    sxy = sum(e.sxy for e in estimators)
+
+    if sxx <= 0:
+        return None
+    return sxy / sxx
+
+
+# Converts a measured sample rate into a drift in ppm relative to the nominal rate
+def rate_to_ppm(rate, nominal_rate):
+    if rate is None:
+        return None
+    return (rate / nominal_rate - 1) * 1e6
+
+
+# Checks whether a measured rate is close enough to the nominal rate to be trusted
+def is_plausible(rate, nominal_rate):
+    return rate is not None and abs(rate_to_ppm(rate, nominal_rate)) <= MAX_PLAUSIBLE_PPM
+
+
+# Resamples 16-bit mono audio captured at measured_rate onto nominal_rate using cubic (Catmull-Rom)
+# interpolation, so that sample offsets in the output correspond to real time at the nominal rate.
+# Params: data: bytes of int16 samples, measured_rate/nominal_rate: sample rates in Hz
+# Returns: Bytes: resampled int16 samples
+def correct_drift(data, measured_rate, nominal_rate):
+    # Only needed for correction, so that recording without it does not depend on numpy
+    import numpy as np
+
+    x = np.frombuffer(data, dtype="<i2")
+    if len(x) < 2:
+        return data
+
+    # Number of input samples advanced per output sample
+    step = measured_rate / nominal_rate
+    num_out = int((len(x) - 1) / step) + 1
+
+    out = np.empty(num_out, dtype="<i2")
+    last = len(x) - 1
+
+    for start in range(0, num_out, RESAMPLE_CHUNK):
+        position = np.arange(start, min(start + RESAMPLE_CHUNK, num_out), dtype=np.float64) * step
+        i = np.floor(position).astype(np.int64)
+        f = position - i
+
+        p0 = x[np.clip(i - 1, 0, last)].astype(np.float64)
+        p1 = x[i].astype(np.float64)
+        p2 = x[np.clip(i + 1, 0, last)].astype(np.float64)
+        p3 = x[np.clip(i + 2, 0, last)].astype(np.float64)
+
+        y = p1 + 0.5 * f * (p2 - p0 + f * (2 * p0 - 5 * p1 + 4 * p2 - p3 + f * (3 * (p1 - p2) + p3 - p0)))
+        out[start:start + len(position)] = np.clip(np.round(y), -32768, 32767)
+
+    return out.tobytes()
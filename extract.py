@@ -0,0 +1,268 @@
+#!/usr/bin/python3.9
+
+"""
+This script extracts a time range from a session directory recorded by
+pyaud.py. Absolute timestamps are mapped onto the {prefix}_{index}.wav
+files and sample offsets using the start time recorded for each file,
+and spans that cross file boundaries are stitched into a single .wav
+file. Only the frames inside the requested range are read.
+"""
+
+import os
+import re
+import sys
+import json
+import wave
+from datetime import datetime, timedelta
+
+
+# Name of the file written to each session directory listing the recordings and when they started
+SESSION_INDEX = "session.json"
+
+# Format used for timestamps in the session index
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+# Number of frames copied at a time when extracting
+COPY_FRAMES = 65536
+
+
+# Adds a recording to the session index of output_directory, creating the index if necessary
+# Params: start_datetime: time the first frame of the file was captured, num_frames: frames in the file,
+#         measured_rate: sample rate measured from the sound card clock,
+#         clock_rate: rate at which the samples in the file advance real time (sample_rate if drift was corrected)
+def append_to_session_index(output_directory, file_name, start_datetime, num_frames, sample_rate,
+                            measured_rate=None, clock_rate=None):
+    index_path = os.path.join(output_directory, SESSION_INDEX)
+
+    if os.path.exists(index_path):
+        with open(index_path, 'r') as json_file:
+            session = json.load(json_file)
+    else:
+        session = {"files": []}
+
+    session["files"].append({"file": file_name,
+                             "start_time": start_datetime.strftime(TIMESTAMP_FORMAT),
+                             "frames": num_frames,
+                             "sample_rate": sample_rate,
+                             "measured_rate": measured_rate,
+                             "clock_rate": clock_rate if clock_rate is not None else sample_rate})
+
+    # Write to a temporary file first so that an interrupted write never corrupts the index
+    temp_path = index_path + ".tmp"
+    with open(temp_path, 'w') as json_file:
+        json.dump(session, json_file, indent=2)
+    os.replace(temp_path, index_path)
+
+
+# Rebuilds the file list of a session recorded before session.json existed using its log file.
+# The log only records when each file finished (to the second), so start times are estimated from the
+# file length and are less accurate than those in a session index.
+def _index_from_log(session_directory):
+    log_files = [f for f in os.listdir(session_directory) if f.endswith("_log.txt")]
+    if not log_files:
+        return []
+
+    files = []
+    finished = None
+
+    with open(os.path.join(session_directory, log_files[0]), 'r') as log_file:
+        for line in log_file:
+            match = re.match(r"Current date and time: (\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})", line)
+            if match:
+                finished = datetime.strptime(match.group(1), "%Y-%m-%d %H:%M:%S")
+                continue
+
+            match = re.match(r"Recording saved as: (.+)", line)
+            if match and finished is not None:
+                file_name = os.path.basename(match.group(1).strip())
+                file_path = os.path.join(session_directory, file_name)
+                if not os.path.exists(file_path):
+                    continue
+
+                with wave.open(file_path, 'rb') as wf:
+                    num_frames = wf.getnframes()
+                    sample_rate = wf.getframerate()
+
+                files.append({"file": file_name,
+                              "start_time": finished - timedelta(seconds=num_frames / sample_rate),
+                              "frames": num_frames,
+                              "sample_rate": sample_rate,
+                              "measured_rate": None,
+                              "clock_rate": sample_rate})
+
+    return files
+
+
+# Loads the recordings of a session directory in the order they were recorded
+# Returns: List: dictionaries with file, start_time (datetime), frames and sample_rate
+def load_session_index(session_directory):
+    index_path = os.path.join(session_directory, SESSION_INDEX)
+
+    if not os.path.exists(index_path):
+        files = _index_from_log(session_directory)
+    else:
+        with open(index_path, 'r') as json_file:
+            files = json.load(json_file)["files"]
+        for entry in files:
+            entry["start_time"] = datetime.strptime(entry["start_time"], TIMESTAMP_FORMAT)
+
+    return sorted(files, key=lambda entry: entry["start_time"])
+
+
+# Converts a user supplied time into a datetime. Accepts "YYYY-MM-DD HH:MM:SS[.ffffff]" or
+# "HH:MM:SS[.ffffff]", in which case the time is taken on the day of reference, or on the following day
+# if that would put it more than 12 hours before reference (e.g. a session running past midnight).
+# Sessions spanning several days need the full date.
+def _parse_time(time_str, reference):
+    for time_format in ("%Y-%m-%d %H:%M:%S.%f", "%Y-%m-%d %H:%M:%S"):
+        try:
+            return datetime.strptime(time_str, time_format)
+        except ValueError:
+            pass
+
+    for time_format in ("%H:%M:%S.%f", "%H:%M:%S"):
+        try:
+            time_of_day = datetime.strptime(time_str, time_format).time()
+        except ValueError:
+            continue
+
+        result = datetime.combine(reference.date(), time_of_day)
+        if result < reference - timedelta(hours=12):
+            result += timedelta(days=1)
+        return result
+
+    raise ValueError(f"Invalid time: {time_str}")
+
+
+# Rate at which the frames of a recording advance real time. Uses the measured sound card clock rate
+# when the session index has one, so that offsets stay accurate on devices whose clock drifts.
+def _clock_rate(entry):
+    return entry.get("clock_rate") or entry["sample_rate"]
+
+
+# Works out which frames of which files cover the range start_datetime to end_datetime
+# Returns: List: (entry, first_frame, last_frame) tuples, last_frame exclusive
+def map_time_range(files, start_datetime, end_datetime):
+    spans = []
+
+    for entry in files:
+        clock_rate = _clock_rate(entry)
+
+        first_frame = round((start_datetime - entry["start_time"]).total_seconds() * clock_rate)
+        last_frame = round((end_datetime - entry["start_time"]).total_seconds() * clock_rate)
+
+        first_frame = min(max(first_frame, 0), entry["frames"])
+        last_frame = min(max(last_frame, 0), entry["frames"])
+
+        if last_frame > first_frame:
+            spans.append((entry, first_frame, last_frame))
+
+    return spans
+
+
+# Writes num_frames frames of silence to an open .wav file
+def _write_silence(out, num_frames):
+    frame_size = out.getnchannels() * out.getsampwidth()
+    silence = bytes(COPY_FRAMES * frame_size)
+
+    while num_frames > 0:
+        frames = min(num_frames, COPY_FRAMES)
+        out.writeframes(silence[:frames * frame_size])
+        num_frames -= frames
+
+
+# Extracts the audio between start_time and end_time from a session directory into a single .wav file
+# Params: session_directory: path of a {location}_{timestamp} directory,
+#         start_time/end_time: datetime objects or strings (see _parse_time),
+#         output_path: .wav file to write,
+#         fill_gaps: insert silence between recordings so that output offsets match absolute time
+# Returns: List: (file name, first_frame, last_frame) of every span copied
+def extract_range(session_directory, start_time, end_time, output_path, fill_gaps=False):
+    files = load_session_index(session_directory)
+    if not files:
+        raise ValueError(f"No recordings found in {session_directory}")
+
+    session_start = files[0]["start_time"]
+    start_datetime = start_time if isinstance(start_time, datetime) else _parse_time(start_time, session_start)
+    end_datetime = end_time if isinstance(end_time, datetime) else _parse_time(end_time, start_datetime)
+
+    if end_datetime <= start_datetime:
+        raise ValueError("end_time must be after start_time")
+
+    spans = map_time_range(files, start_datetime, end_datetime)
+    if not spans:
+        raise ValueError(f"No recordings cover {start_datetime} to {end_datetime}")
+
+    sample_rate = spans[0][0]["sample_rate"]
+    if any(entry["sample_rate"] != sample_rate for entry, _, _ in spans):
+        raise ValueError("Cannot stitch recordings with different sample rates")
+
+    copied = []
+    expected_frame = 0
+
+    with wave.open(output_path, 'wb') as out:
+        for entry, first_frame, last_frame in spans:
+            clock_rate = _clock_rate(entry)
+
+            # Position of this span relative to the start of the range, used to detect gaps and overlaps
+            span_seconds = (entry["start_time"] - start_datetime).total_seconds() + first_frame / clock_rate
+            span_frame = round(span_seconds * sample_rate)
+
+            # Recordings whose time ranges overlap would otherwise have the overlapping frames copied twice
+            if span_frame < expected_frame:
+                first_frame += round((expected_frame - span_frame) * clock_rate / sample_rate)
+                span_frame = expected_frame
+                if first_frame >= last_frame:
+                    print(f"Skipping {entry['file']}, which overlaps the previous recording")
+                    continue
+
+            with wave.open(os.path.join(session_directory, entry["file"]), 'rb') as wf:
+                if not copied:
+                    out.setnchannels(wf.getnchannels())
+                    out.setsampwidth(wf.getsampwidth())
+                    out.setframerate(sample_rate)
+                elif (wf.getnchannels(), wf.getsampwidth()) != (out.getnchannels(), out.getsampwidth()):
+                    raise ValueError("Cannot stitch recordings with different formats")
+
+                if span_frame > expected_frame:
+                    gap = span_frame - expected_frame
+                    if fill_gaps:
+                        print(f"Filling {gap / sample_rate:.3f}s gap before {entry['file']} with silence")
+                        _write_silence(out, gap)
+                    elif copied:
+                        print(f"Skipping {gap / sample_rate:.3f}s gap before {entry['file']}")
+
+                # Seek straight to the first frame needed instead of reading the file from the start
+                wf.setpos(first_frame)
+                remaining = last_frame - first_frame
+                while remaining > 0:
+                    data = wf.readframes(min(remaining, COPY_FRAMES))
+                    if not data:
+                        break
+                    out.writeframes(data)
+                    remaining -= len(data) // (wf.getnchannels() * wf.getsampwidth())
+
+            expected_frame = span_frame + last_frame - first_frame
+            copied.append((entry["file"], first_frame, last_frame))
+            print(f"Extracted frames {first_frame} to {last_frame} of {entry['file']}")
+
+        total_frames = round((end_datetime - start_datetime).total_seconds() * sample_rate)
+        if fill_gaps and total_frames > expected_frame:
+            print(f"Filling {(total_frames - expected_frame) / sample_rate:.3f}s gap after last recording with silence")
+            _write_silence(out, total_frames - expected_frame)
+
+    print(f"Extract saved as: {output_path}")
+    return copied
+
+
+if __name__ == "__main__":
+    # To use: python extract.py <session directory> <start time> <end time> <output .wav file>
+    if len(sys.argv) != 5:
+        print("Usage: python extract.py <session directory> <start time> <end time> <output .wav file>")
+        sys.exit(1)
+
+    try:
+        extract_range(sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4])
+    except (ValueError, OSError, wave.Error) as e:
+        print(f"Error! Could not extract audio: {e}")
+        sys.exit(1)
@@ -0,0 +1,381 @@
+#!/usr/bin/python3.9
+
+"""
+This script offloads session directories recorded by pyaud.py (e.g. from
+the SD card of a recovered unit) to a target directory. A manifest of
+every copied file with its size, modification time and BLAKE2 hash is
+kept in the target, so repeated offloads only copy files that are new or
+changed, interrupted copies resume where they stopped and copies can be
+verified against the manifest at any time.
+"""
+
+import os
+import sys
+import json
+import errno
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+# Name of the manifest file kept at the root of the target directory
+MANIFEST = "offload_manifest.json"
+
+# Suffix of partially copied files, which are renamed once the copy is complete
+PART_SUFFIX = ".part"
+
+# Suffix of the file recording the size and modification time of the source a .part file was copied from
+PART_INFO_SUFFIX = ".part.json"
+
+# Size of the buffer used for buffered copies and hashing
+BUFFER_SIZE = 8 * 1024 * 1024
+
+# Number of files copied at the same time by default
+DEFAULT_WORKERS = 4
+
+# The manifest is saved at most this often during an offload, and at least this many times the time the
+# last save took, so that writing it stays a small fraction of the offload however many files it lists
+MANIFEST_SAVE_SECONDS = 10
+MANIFEST_SAVE_RATIO = 20
+
+
+# Returns the BLAKE2 hash object used for the manifest
+def _new_hash():
+    return hashlib.blake2b(digest_size=16)
+
+
+# Feeds length bytes of an open file, starting at its current position, into hasher
+def _hash_into(hasher, f, length, buffer):
+    view = memoryview(buffer)
+    while length > 0:
+        n = f.readinto(view[:min(length, len(buffer))])
+        if not n:
+            break
+        hasher.update(view[:n])
+        length -= n
+
+
+# Hashes a whole file, bypassing the page cache where possible so that the data is read back from disk
+def hash_file(path):
+    hasher = _new_hash()
+    buffer = bytearray(BUFFER_SIZE)
+
+    with open(path, 'rb') as f:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+        _hash_into(hasher, f, os.fstat(f.fileno()).st_size, buffer)
+
+    return hasher.hexdigest()
+
+
+# Lists every file below source as paths relative to source, skipping anything left behind by an offload
+def scan_source(source):
+    files = {}
+
+    for root, _, file_names in os.walk(source):
+        for file_name in file_names:
+            if file_name == MANIFEST or file_name.endswith(PART_SUFFIX) or file_name.endswith(PART_INFO_SUFFIX):
+                continue
+
+            path = os.path.join(root, file_name)
+            stat = os.stat(path)
+            files[os.path.relpath(path, source)] = {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+    return files
+
+
+# Loads the manifest of a target directory, or an empty one if nothing has been offloaded yet
+def load_manifest(target):
+    manifest_path = os.path.join(target, MANIFEST)
+    if not os.path.exists(manifest_path):
+        return {}
+
+    with open(manifest_path, 'r') as json_file:
+        return json.load(json_file)
+
+
+# Writes the manifest of a target directory
+def save_manifest(target, manifest):
+    manifest_path = os.path.join(target, MANIFEST)
+
+    # Write to a temporary file first so that an interruption never corrupts the manifest
+    temp_path = manifest_path + ".tmp"
+    with open(temp_path, 'w') as json_file:
+        # json.dumps uses the C encoder, unlike json.dump, which matters for manifests of 100k+ files
+        json_file.write(json.dumps(manifest, separators=(",", ":")))
+    os.replace(temp_path, manifest_path)
+
+
+# Errors meaning a zero copy call is not supported for this pair of files, rather than that the copy failed
+UNSUPPORTED_ERRNOS = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP)
+
+# Largest number of bytes passed to a single zero copy call
+ZERO_COPY_CHUNK = 1 << 30
+
+
+# Copies with copy_file_range, which can avoid reading the data at all on filesystems that share blocks.
+# Returns the offset reached, which is short of length if the call is not supported for these files.
+def _copy_file_range(in_fd, out_fd, offset, length):
+    while offset < length:
+        try:
+            n = os.copy_file_range(in_fd, out_fd, min(length - offset, ZERO_COPY_CHUNK), offset, offset)
+        except OSError as e:
+            if e.errno in UNSUPPORTED_ERRNOS:
+                return offset
+            raise
+
+        if n == 0:
+            break
+        offset += n
+
+    return offset
+
+
+# Copies with sendfile, which works across filesystems (e.g. SD card to disk) where copy_file_range
+# returns EXDEV. sendfile writes at the current position of out_fd, so it is moved to offset first.
+def _sendfile(in_fd, out_fd, offset, length):
+    os.lseek(out_fd, offset, os.SEEK_SET)
+
+    while offset < length:
+        try:
+            n = os.sendfile(out_fd, in_fd, offset, min(length - offset, ZERO_COPY_CHUNK))
+        except OSError as e:
+            if e.errno in UNSUPPORTED_ERRNOS:
+                return offset
+            raise
+
+        if n == 0:
+            break
+        offset += n
+
+    return offset
+
+
+# Copies the bytes of src from offset onwards using the kernel, without passing them through Python.
+# Tries copy_file_range, then sendfile, and returns the offset reached so that the caller can finish
+# with a buffered copy if neither is supported.
+def _copy_zero_copy(src, dst, offset, length):
+    in_fd, out_fd = src.fileno(), dst.fileno()
+
+    if hasattr(os, "copy_file_range"):
+        offset = _copy_file_range(in_fd, out_fd, offset, length)
+    if offset < length and hasattr(os, "sendfile"):
+        offset = _sendfile(in_fd, out_fd, offset, length)
+
+    return offset
+
+
+# Copies the bytes of src from offset onwards through a large reusable buffer, hashing them on the way
+def _copy_buffered(src, dst, offset, length, hasher, buffer):
+    view = memoryview(buffer)
+    src.seek(offset)
+    dst.seek(offset)
+
+    while offset < length:
+        n = src.readinto(view[:min(length - offset, len(buffer))])
+        if not n:
+            break
+        if hasher is not None:
+            hasher.update(view[:n])
+        dst.write(view[:n])
+        offset += n
+
+    return offset
+
+
+# Returns how many bytes of an existing .part file can be kept. A .part file is only resumed if it was
+# copied from a source with the same size and modification time, otherwise it may hold data of an older
+# or different version of the file.
+def _resume_offset(part_path, source_info):
+    info_path = part_path[:-len(PART_SUFFIX)] + PART_INFO_SUFFIX
+    if not os.path.exists(part_path) or not os.path.exists(info_path):
+        return 0
+
+    try:
+        with open(info_path, 'r') as json_file:
+            part_info = json.load(json_file)
+    except (OSError, ValueError):
+        return 0
+
+    offset = os.path.getsize(part_path)
+    if part_info != source_info or offset > source_info["size"]:
+        return 0
+    return offset
+
+
+# Copies one file, resuming from its .part file if an earlier copy of the same source was interrupted
+# Returns: String: hash of the copied data, or None if verification is disabled
+def copy_file(src_path, dst_path, size, verify=True):
+    part_path = dst_path + PART_SUFFIX
+    info_path = dst_path + PART_INFO_SUFFIX
+    os.makedirs(os.path.dirname(dst_path) or ".", exist_ok=True)
+
+    source_info = {"size": size, "mtime": os.stat(src_path).st_mtime_ns}
+    offset = _resume_offset(part_path, source_info)
+    resumed = offset > 0
+
+    # Record which source the .part file belongs to before any data is written to it
+    if not resumed:
+        with open(info_path, 'w') as json_file:
+            json.dump(source_info, json_file)
+
+    buffer = bytearray(BUFFER_SIZE)
+    hasher = _new_hash() if verify else None
+
+    with open(src_path, 'rb') as src, open(part_path, 'r+b' if offset else 'wb') as dst:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(src.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+        if verify:
+            # The hash has to cover the whole source, so the already copied part is read again from the source
+            _hash_into(hasher, src, offset, buffer)
+            offset = _copy_buffered(src, dst, offset, size, hasher, buffer)
+        else:
+            dst.truncate(offset)
+            offset = _copy_zero_copy(src, dst, offset, size)
+            offset = _copy_buffered(src, dst, offset, size, None, buffer)
+
+        dst.truncate(offset)
+        dst.flush()
+        os.fsync(dst.fileno())
+
+    if offset != size:
+        raise IOError(f"{src_path} changed size while being copied")
+
+    os.replace(part_path, dst_path)
+    os.remove(info_path)
+    src_stat = os.stat(src_path)
+    os.utime(dst_path, ns=(src_stat.st_atime_ns, src_stat.st_mtime_ns))
+
+    if not verify:
+        return None
+
+    digest = hasher.hexdigest()
+    if hash_file(dst_path) != digest:
+        os.remove(dst_path)
+
+        # The .part file may have been left by an older version of the source file, so start again from scratch
+        if resumed:
+            return copy_file(src_path, dst_path, size, verify=verify)
+        raise IOError(f"Verification failed for {dst_path}")
+
+    return digest
+
+
+# Works out which source files are new or changed since the last offload into target
+def pending_files(source_files, manifest, target):
+    pending = []
+
+    for relative_path, info in source_files.items():
+        entry = manifest.get(relative_path)
+        dst_path = os.path.join(target, relative_path)
+
+        if (entry is not None and entry["size"] == info["size"] and entry["mtime"] == info["mtime"] and
+                os.path.exists(dst_path) and os.path.getsize(dst_path) == info["size"]):
+            continue
+
+        pending.append(relative_path)
+
+    return pending
+
+
+# Copies every new or changed file below source into target, several files at a time
+# Params: source: card or session directory to offload, target: directory to copy into,
+#         workers: number of files copied in parallel, verify: hash each copy and check it against the source
+# Returns: List: relative paths of files that could not be copied
+def offload(source, target, workers=DEFAULT_WORKERS, verify=True):
+    os.makedirs(target, exist_ok=True)
+
+    source_files = scan_source(source)
+    manifest = load_manifest(target)
+    pending = pending_files(source_files, manifest, target)
+
+    total_bytes = sum(source_files[p]["size"] for p in pending)
+    print(f"Offloading {len(pending)} of {len(source_files)} file(s) ({total_bytes / 1e9:.2f} GB) to {target}")
+
+    # Largest files first so that one big file does not hold up the end of the offload
+    pending.sort(key=lambda p: source_files[p]["size"], reverse=True)
+
+    copied = []
+    failed = []
+
+    def copy_one(relative_path):
+        return copy_file(os.path.join(source, relative_path), os.path.join(target, relative_path),
+                         source_files[relative_path]["size"], verify=verify)
+
+    # The manifest is only touched by this thread, so the workers never wait for it to be written.
+    # It is saved in batches and once more at the end, even if the offload is interrupted; files copied
+    # after the last save are simply copied again by the next offload.
+    last_save = time.monotonic()
+    save_interval = MANIFEST_SAVE_SECONDS
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(copy_one, p): p for p in pending}
+        try:
+            for future in as_completed(futures):
+                relative_path = futures[future]
+                try:
+                    digest = future.result()
+                except OSError as e:
+                    failed.append(relative_path)
+                    print(f"Error! Could not copy {relative_path}: {e}")
+                    continue
+
+                info = source_files[relative_path]
+                manifest[relative_path] = {"size": info["size"], "mtime": info["mtime"], "hash": digest}
+                copied.append(relative_path)
+                print(f"Copied {relative_path}")
+
+                if time.monotonic() - last_save >= save_interval:
+                    save_started = time.monotonic()
+                    save_manifest(target, manifest)
+                    last_save = time.monotonic()
+                    save_interval = max(MANIFEST_SAVE_SECONDS, (last_save - save_started) * MANIFEST_SAVE_RATIO)
+        except KeyboardInterrupt:
+            # Let the copies in progress finish (they resume from their .part files anyway) but start no more
+            for future in futures:
+                future.cancel()
+            raise
+        finally:
+            save_manifest(target, manifest)
+
+    print(f"Offload complete: {len(copied)} copied, {len(failed)} failed, "
+          f"{len(source_files) - len(pending)} already up to date.")
+    return sorted(failed)
+
+
+# Re-hashes every file in the manifest of target and reports any that are missing or do not match
+# Returns: List: relative paths of files that failed verification
+def verify_offload(target, workers=DEFAULT_WORKERS):
+    manifest = load_manifest(target)
+    failed = []
+
+    def check(relative_path):
+        entry = manifest[relative_path]
+        path = os.path.join(target, relative_path)
+
+        if not os.path.exists(path) or os.path.getsize(path) != entry["size"]:
+            return False
+        return entry["hash"] is None or hash_file(path) == entry["hash"]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(check, p): p for p in manifest}
+        for future in as_completed(futures):
+            if not future.result():
+                failed.append(futures[future])
+                print(f"Verification failed: {futures[future]}")
+
+    unhashed = sum(1 for entry in manifest.values() if entry["hash"] is None)
+    print(f"Verified {len(manifest) - len(failed)} of {len(manifest)} file(s)"
+          + (f" ({unhashed} copied without verification were only checked by size)" if unhashed else ""))
+    return sorted(failed)
+
+
+if __name__ == "__main__":
+    # To use: python offload.py <source directory> <target directory>
+    if len(sys.argv) != 3:
+        print("Usage: python offload.py <source directory> <target directory>")
+        sys.exit(1)
+
+    if offload(sys.argv[1], sys.argv[2]):
+        sys.exit(1)
@@ -62,7 +62,10 @@ def list_audio_devices(index=None, return_name=False):
 
 # Main Function for handling recording session
 def record_audio(device_index=1, duration=10, start_time=None, end_time=None, period=None,
-                 sample_rate=96000, location="default", current_directory=".", prefix="output"):
+                 sample_rate=96000, location="default", current_directory=".", prefix="output", thumbnails=False,
+                 correct_drift=False):
+    from drift import ClockDriftEstimator, combined_rate, rate_to_ppm, is_plausible
+
     p = pyaudio.PyAudio()
 
     # Converts start_time string to date_time object
@@ -125,6 +128,9 @@ def record_audio(device_index=1, duration=10, start_time=None, end_time=None, pe
 
     print(f"Recording for {num_sessions} session(s) with a duration of {duration} seconds")
 
+    # One clock drift estimator per recording, pooled to measure the sound card over the whole run
+    drift_estimators = []
+
     for index in range(1, num_sessions + 1):
 
         print("\n")
@@ -157,10 +163,19 @@ def record_audio(device_index=1, duration=10, start_time=None, end_time=None, pe
                             input_device_index=device_index,
                             frames_per_buffer=1024)
 
+            # Capture starts as soon as the stream is opened, so take the wall clock and monotonic time together
+            # right away. They are used below to turn the monotonic time of the first frame into a wall clock time.
+            opened_datetime = datetime.now()
+            opened_monotonic = time.monotonic()
+
             frames = []
 
             print(f"Recording audio with sample rate {sample_rate}, duration {duration}s")
 
+            # Compares frames received with the monotonic clock to measure the real sample rate of the device
+            estimator = ClockDriftEstimator(sample_rate)
+            drift_estimators.append(estimator)
+
             # The formula (sampling rate / frames per iteration) * duration is used to calculate the
             # total number of iterations needed to cover the desired duration.
             # (44100 / 1024) gives the number of iterations required to cover one second of audio data.
@@ -169,12 +184,42 @@ def record_audio(device_index=1, duration=10, start_time=None, end_time=None, pe
                 data = stream.read(1024)
                 # Appends chunk to audio data
                 frames.append(data)
+                estimator.update(time.monotonic(), (i + 1) * 1024)
 
             print("Recording complete.")
             current_datetime = datetime.now()
             current_datetime_str = current_datetime.strftime('%Y-%m-%d %H:%M:%S')
             print("Current date and time:", current_datetime_str)
 
+            # Time the first frame was captured, stored in the session index so that extract.py can map absolute
+            # timestamps onto sample offsets. The intercept of the drift fit is used where available, as it is not
+            # delayed by the first read; otherwise fall back to the time the stream was opened.
+            recording_start = opened_datetime
+            session_rate = combined_rate(drift_estimators)
+            capture_start = estimator.time_at_frames(0, session_rate if is_plausible(session_rate, sample_rate) else None)
+            if capture_start is not None and abs(capture_start - opened_monotonic) < 1:
+                recording_start = opened_datetime + timedelta(seconds=capture_start - opened_monotonic)
+
+            audio_data = b''.join(frames)  # concatenates audio data stored in frames list into single byte string
+
+            measured_rate = estimator.rate
+            if measured_rate is not None:
+                print(f"Measured sample rate: {measured_rate:.3f} Hz ({rate_to_ppm(measured_rate, sample_rate):+.1f} ppm), "
+                      f"session: {session_rate:.3f} Hz ({rate_to_ppm(session_rate, sample_rate):+.1f} ppm)")
+
+            # Rate at which the samples in the file advance real time, used by extract.py to map timestamps
+            clock_rate = session_rate if is_plausible(session_rate, sample_rate) else sample_rate
+
+            # Resample using the estimate pooled over the session, which is far less noisy than one recording's
+            if correct_drift:
+                if is_plausible(session_rate, sample_rate):
+                    from drift import correct_drift as resample_drift
+                    audio_data = resample_drift(audio_data, session_rate, sample_rate)
+                    clock_rate = sample_rate
+                    print(f"Corrected clock drift: {len(frames) * 1024} -> {len(audio_data) // 2} frames")
+                else:
+                    print("Clock drift estimate unavailable or implausible, recording saved uncorrected")
+
             # Generate a file name based on the index and save to output directory
             file_name = f"{prefix}_{index}.wav"
             file_path = os.path.join(output_directory, file_name)
@@ -183,11 +228,24 @@ def record_audio(device_index=1, duration=10, start_time=None, end_time=None, pe
                 wf.setnchannels(1)  # set to mono audio
                 wf.setsampwidth(pyaudio.PyAudio().get_sample_size(pyaudio.paInt16))
                 wf.setframerate(sample_rate)
-                wf.writeframes(b''.join(frames))  # concatenates audio data stored in frames list into single byte string
+                wf.writeframes(audio_data)
                 wf.close()
 
             print(f"Recording saved as: {file_path}")
 
+            from extract import append_to_session_index
+            append_to_session_index(output_directory, file_name, recording_start, len(audio_data) // 2, sample_rate,
+                                    measured_rate=measured_rate, clock_rate=clock_rate)
+
+            # Build waveform and spectrogram thumbnails for the new file if requested.
+            # Thumbnails are optional, so a failure is logged and does not stop the remaining sessions.
+            if thumbnails:
+                try:
+                    from pyramid import build_pyramid
+                    print(f"Thumbnails saved as: {build_pyramid(file_path)}")
+                except Exception as e:
+                    print(f"Error! Could not build thumbnails for {file_path}: {e}")
+
             # Calculate next recording session start time if there is more than one session
             if num_sessions > 1:
                 start_datetime = start_datetime + timedelta(seconds=period_seconds)
@@ -202,6 +260,11 @@ def record_audio(device_index=1, duration=10, start_time=None, end_time=None, pe
             stream.close()
             p.terminate()
 
+    session_rate = combined_rate(drift_estimators)
+    if session_rate is not None:
+        print(f"\nSession clock drift: {rate_to_ppm(session_rate, sample_rate):+.1f} ppm "
+              f"(measured {session_rate:.3f} Hz, nominal {sample_rate} Hz)")
+
     # Close the log file
     log_file.close()
 
@@ -251,10 +314,24 @@ if __name__ == "__main__":
     parser.add_argument("--record", action="store_true", help="Record audio for 30 seconds")
     parser.add_argument("--device", type=int, help="Specify the input audio device index for recording [int]")
     parser.add_argument("--play", help="Path to the audio file for playback")
+    parser.add_argument("--extract", nargs=3, metavar=("SESSION_DIR", "START", "END"),
+                        help="Extract the audio between START and END (\"YYYY-MM-DD HH:MM:SS\" or \"HH:MM:SS\") from a session directory")
+    parser.add_argument("-o", "--output", default="extract.wav", help="Output file for --extract (default is extract.wav)")
+    parser.add_argument("--fill-gaps", action="store_true", help="Fill gaps between recordings with silence when extracting")
+    parser.add_argument("--offload", nargs=2, metavar=("SOURCE", "TARGET"),
+                        help="Copy new or changed session files from SOURCE (e.g. an SD card) to TARGET")
+    parser.add_argument("--workers", type=int, default=4, help="Number of files copied at the same time by --offload (default is 4)")
+    parser.add_argument("--no-verify", action="store_true", help="Skip hashing and verification when offloading for maximum speed")
+    parser.add_argument("--verify-offload", metavar="TARGET", help="Check an offloaded directory against its manifest")
+    parser.add_argument("--build-thumbnails", metavar="SESSION_DIR", nargs="+",
+                        help="Build waveform and spectrogram thumbnails for new recordings in session directories")
 
     # Recording Parameters
     parser.add_argument("-d", "--duration", type=int, help="Specify the number of seconds to record (default is 10 seconds)")
     parser.add_argument("-r", "--rate", type=int, help="Specify Sampling Rate (hz) (default is 48000 hz)")
+    parser.add_argument("--thumbnails", action="store_true", help="Build thumbnails for each recording as it is saved")
+    parser.add_argument("--correct-drift", action="store_true",
+                        help="Resample recordings to correct for the measured sound card clock drift")
 
     # Optional argument for specifying a JSON file with additional parameters
     parser.add_argument("-p", "--parameters", help="Path to a JSON file with additional parameters")
@@ -274,10 +351,11 @@ if __name__ == "__main__":
 
             # Merge additional parameters with the command line arguments
             args.__dict__.update(additional_params)
-            record_audio(device_index=args.device, duration=time_to_seconds(args.duration), start_time=args.start_time, end_time=args.end_time, period=args.period, sample_rate=args.sample_rate, location=args.location)
+            record_audio(device_index=args.device, duration=time_to_seconds(args.duration), start_time=args.start_time, end_time=args.end_time, period=args.period, sample_rate=args.sample_rate, location=args.location, thumbnails=args.thumbnails, correct_drift=args.correct_drift)
 
         elif args.device is not None:
-            record_audio(device_index=args.device - 1, duration=args.duration, sample_rate=args.rate)
+            record_audio(device_index=args.device - 1, duration=args.duration, sample_rate=args.rate, thumbnails=args.thumbnails,
+                         correct_drift=args.correct_drift)
 
         else:
             print("Please specify the input audio device index using the --device option or a file with configured parameters using -p.")
@@ -285,5 +363,30 @@ if __name__ == "__main__":
     elif args.play:
         play_audio(args.play)
 
+    elif args.extract:
+        from extract import extract_range
+        session_directory, start, end = args.extract
+        try:
+            extract_range(session_directory, start, end, args.output, fill_gaps=args.fill_gaps)
+        except (ValueError, OSError, wave.Error) as e:
+            print(f"Error! Could not extract audio: {e}")
+            sys.exit(1)
+
+    elif args.offload:
+        from offload import offload
+        source, target = args.offload
+        if offload(source, target, workers=args.workers, verify=not args.no_verify):
+            sys.exit(1)
+
+    elif args.verify_offload:
+        from offload import verify_offload
+        if verify_offload(args.verify_offload, workers=args.workers):
+            sys.exit(1)
+
+    elif args.build_thumbnails:
+        from pyramid import update_session
+        for session_directory in args.build_thumbnails:
+            update_session(session_directory)
+
     else:
         print("No action specified. Use --help to list available commands")
@@ -0,0 +1,335 @@
+#!/usr/bin/python3.9
+
+"""
+This script builds multi-resolution thumbnails of the .wav files recorded
+by pyaud.py. Each recording gets a min/max/RMS waveform pyramid and a
+downsampled spectrogram pyramid, stored as a sidecar folder of .npy
+arrays in a thumbnails folder inside the session directory. The arrays
+are memory mapped when loaded, so a viewer can draw any zoom level of a
+long session by reading only the points it displays.
+"""
+
+import os
+import sys
+import json
+import wave
+import shutil
+import numpy as np
+
+
+# Name of the folder created inside each session directory to hold sidecar folders
+THUMBNAIL_DIRECTORY = "thumbnails"
+
+# Name of the file in each sidecar folder describing the recording and the levels it holds.
+# It is written last, so a sidecar without it is incomplete and gets rebuilt.
+SIDECAR_META = "meta.json"
+
+# Number of samples summarised by one point of the finest waveform level
+WAVE_BLOCK = 1024
+
+# FFT size and number of FFT windows averaged into one column of the finest spectrogram level
+SPEC_NFFT = 1024
+SPEC_GROUP = 8
+SPEC_HOP = SPEC_NFFT * SPEC_GROUP
+
+# Number of frequency bands kept per spectrogram column
+SPEC_BINS = 64
+
+# Each level of the pyramid is this many times coarser than the one below it
+PYRAMID_FACTOR = 4
+
+# Range of dB values (relative to a full scale sine) mapped onto 0 - 255 when storing the spectrogram
+SPEC_DB_FLOOR = -120.0
+
+# Number of samples read from the .wav file at a time, a multiple of both WAVE_BLOCK and SPEC_HOP
+READ_FRAMES = SPEC_HOP * 64
+
+# Power of a full scale sine in a single bin of a Hann windowed FFT, used as the 0 dB reference
+FULL_SCALE_POWER = (32768 * SPEC_NFFT / 4) ** 2
+
+
+# Returns the path of the sidecar folder belonging to a .wav file
+def sidecar_path_for(wav_path):
+    directory, file_name = os.path.split(wav_path)
+    stem = os.path.splitext(file_name)[0]
+    return os.path.join(directory, THUMBNAIL_DIRECTORY, stem)
+
+
+# Reads the meta.json file of a sidecar folder
+def _load_meta(sidecar_path):
+    with open(os.path.join(sidecar_path, SIDECAR_META), 'r') as json_file:
+        return json.load(json_file)
+
+
+# Memory maps one level array of a sidecar folder, so that only the slices used are read from disk
+def _open_level(sidecar_path, name):
+    return np.load(os.path.join(sidecar_path, name + ".npy"), mmap_mode='r')
+
+
+# Reads the .wav file in chunks and yields them as mono int16 arrays
+def _read_chunks(wf):
+    channels = wf.getnchannels()
+
+    if wf.getsampwidth() != 2:
+        raise ValueError("Only 16-bit .wav files are supported")
+
+    while True:
+        data = wf.readframes(READ_FRAMES)
+        if not data:
+            break
+
+        samples = np.frombuffer(data, dtype="<i2")
+        if channels > 1:
+            samples = samples.reshape(-1, channels).mean(axis=1).astype(np.int16)
+        yield samples
+
+
+# Min, max and sum of squares of each WAVE_BLOCK sized block in samples
+# The last block may be shorter than WAVE_BLOCK, so the number of samples in each block is also returned
+def _waveform_blocks(samples):
+    full = len(samples) // WAVE_BLOCK * WAVE_BLOCK
+    blocks = samples[:full].reshape(-1, WAVE_BLOCK)
+
+    mins = [blocks.min(axis=1)]
+    maxs = [blocks.max(axis=1)]
+    sumsq = [np.square(blocks, dtype=np.float64).sum(axis=1)]
+    counts = [np.full(len(blocks), WAVE_BLOCK, dtype=np.int64)]
+
+    tail = samples[full:]
+    if len(tail):
+        mins.append(tail.min(keepdims=True))
+        maxs.append(tail.max(keepdims=True))
+        sumsq.append(np.square(tail, dtype=np.float64).sum(keepdims=True))
+        counts.append(np.array([len(tail)], dtype=np.int64))
+
+    return np.concatenate(mins), np.concatenate(maxs), np.concatenate(sumsq), np.concatenate(counts)
+
+
+# Band power of each SPEC_HOP sized column in samples, summed over the FFT windows in the column
+# Partial windows at the end of the file are zero padded
+def _spectrogram_columns(samples):
+    num_windows = -(-len(samples) // SPEC_NFFT)
+    padded = np.zeros(num_windows * SPEC_NFFT, dtype=np.float64)
+    padded[:len(samples)] = samples
+
+    windows = padded.reshape(-1, SPEC_NFFT) * np.hanning(SPEC_NFFT)
+    power = np.square(np.abs(np.fft.rfft(windows, axis=1)))
+
+    # Drop the Nyquist bin and average neighbouring bins down to SPEC_BINS bands
+    bands = power[:, :SPEC_NFFT // 2].reshape(num_windows, SPEC_BINS, -1).mean(axis=2)
+
+    starts = np.arange(0, num_windows, SPEC_GROUP)
+    column_power = np.add.reduceat(bands, starts, axis=0)
+    column_windows = np.diff(np.append(starts, num_windows))
+
+    return column_power, column_windows
+
+
+# Combines groups of PYRAMID_FACTOR neighbouring points into one point of the next level
+def _reduce(values, ufunc):
+    starts = np.arange(0, len(values), PYRAMID_FACTOR)
+    return ufunc.reduceat(values, starts, axis=0)
+
+
+# Converts band power into dB and quantises it to uint8 for storage
+def _quantise_power(power, windows):
+    mean_power = power / windows[:, None]
+    db = 10 * np.log10(mean_power / FULL_SCALE_POWER + 1e-20)
+    scaled = (db - SPEC_DB_FLOOR) * (255 / -SPEC_DB_FLOOR)
+    return np.clip(np.round(scaled), 0, 255).astype(np.uint8)
+
+
+# Builds the waveform and spectrogram pyramids for one .wav file and writes them to its sidecar folder
+# Params: wav_path: path of the recording, sidecar_path: optional output folder
+# Returns: String: path of the sidecar folder written
+def build_pyramid(wav_path, sidecar_path=None):
+    if sidecar_path is None:
+        sidecar_path = sidecar_path_for(wav_path)
+
+    source_stat = os.stat(wav_path)
+
+    mins, maxs, sumsq, counts = [], [], [], []
+    spec_power, spec_windows = [], []
+
+    with wave.open(wav_path, 'rb') as wf:
+        sample_rate = wf.getframerate()
+        num_frames = wf.getnframes()
+
+        # READ_FRAMES is a multiple of both block sizes so only the final chunk can produce partial blocks
+        for samples in _read_chunks(wf):
+            block_min, block_max, block_sumsq, block_count = _waveform_blocks(samples)
+            mins.append(block_min)
+            maxs.append(block_max)
+            sumsq.append(block_sumsq)
+            counts.append(block_count)
+
+            column_power, column_windows = _spectrogram_columns(samples)
+            spec_power.append(column_power)
+            spec_windows.append(column_windows)
+
+    meta = {"sample_rate": sample_rate,
+            "num_frames": num_frames,
+            "wave_block": WAVE_BLOCK,
+            "spec_hop": SPEC_HOP,
+            "factor": PYRAMID_FACTOR,
+            "source_size": source_stat.st_size,
+            "source_mtime": source_stat.st_mtime_ns,
+            "wave_levels": 0,
+            "spec_levels": 0}
+    arrays = {}
+
+    if num_frames > 0:
+        mins = np.concatenate(mins)
+        maxs = np.concatenate(maxs)
+        sumsq = np.concatenate(sumsq)
+        counts = np.concatenate(counts)
+
+        level = 0
+        while True:
+            rms = np.sqrt(sumsq / counts)
+            arrays[f"wave_min_{level}"] = mins
+            arrays[f"wave_max_{level}"] = maxs
+            arrays[f"wave_rms_{level}"] = np.minimum(np.round(rms), 32767).astype(np.int16)
+            level += 1
+
+            if len(mins) == 1:
+                break
+
+            mins = _reduce(mins, np.minimum)
+            maxs = _reduce(maxs, np.maximum)
+            sumsq = _reduce(sumsq, np.add)
+            counts = _reduce(counts, np.add)
+
+        meta["wave_levels"] = level
+
+        spec_power = np.concatenate(spec_power)
+        spec_windows = np.concatenate(spec_windows)
+
+        level = 0
+        while True:
+            arrays[f"spec_{level}"] = _quantise_power(spec_power, spec_windows)
+            level += 1
+
+            if len(spec_power) == 1:
+                break
+
+            spec_power = _reduce(spec_power, np.add)
+            spec_windows = _reduce(spec_windows, np.add)
+
+        meta["spec_levels"] = level
+
+    # Levels are stored uncompressed so that they can be memory mapped and sliced without reading them whole
+    if os.path.exists(sidecar_path):
+        shutil.rmtree(sidecar_path)
+    os.makedirs(sidecar_path)
+
+    for name, array in arrays.items():
+        np.save(os.path.join(sidecar_path, name + ".npy"), array)
+
+    # meta.json is written last, through a temporary file, so an interrupted build is never mistaken for a complete one
+    meta_path = os.path.join(sidecar_path, SIDECAR_META)
+    with open(meta_path + ".tmp", 'w') as json_file:
+        json.dump(meta, json_file, indent=2)
+    os.replace(meta_path + ".tmp", meta_path)
+
+    return sidecar_path
+
+
+# Checks whether the sidecar folder of a recording is complete and was built from the current version of the file
+def is_up_to_date(wav_path, sidecar_path=None):
+    if sidecar_path is None:
+        sidecar_path = sidecar_path_for(wav_path)
+
+    source_stat = os.stat(wav_path)
+    try:
+        meta = _load_meta(sidecar_path)
+        return meta["source_size"] == source_stat.st_size and meta["source_mtime"] == source_stat.st_mtime_ns
+    except (OSError, ValueError, KeyError):
+        return False
+
+
+# Builds sidecar folders for every recording in a session directory that does not have an up to date one yet
+# Params: session_directory: path of a {location}_{timestamp} directory
+# Returns: List: paths of the sidecar folders that were (re)built
+def update_session(session_directory):
+    built = []
+
+    for file_name in sorted(os.listdir(session_directory)):
+        if not file_name.lower().endswith(".wav"):
+            continue
+
+        wav_path = os.path.join(session_directory, file_name)
+        if is_up_to_date(wav_path):
+            continue
+
+        # One unreadable file (e.g. the half-written last recording of a recovered unit) must not stop the batch
+        print(f"Building thumbnails for {wav_path}")
+        try:
+            built.append(build_pyramid(wav_path))
+        except Exception as e:
+            print(f"Error! Could not build thumbnails for {wav_path}: {e}")
+
+    return built
+
+
+# Picks the coarsest level that still has at least `width` points between start_frame and end_frame
+def _choose_level(meta, kind, width, start_frame, end_frame):
+    base = meta["wave_block"] if kind == "wave" else meta["spec_hop"]
+    factor = meta["factor"]
+    num_levels = meta[f"{kind}_levels"]
+
+    level = 0
+    while level + 1 < num_levels and (end_frame - start_frame) / (base * factor ** (level + 1)) >= width:
+        level += 1
+
+    step = base * factor ** level
+    first = start_frame // step
+    last = -(-end_frame // step)
+    return level, first, last
+
+
+# Loads the waveform points covering start_frame to end_frame at the coarsest level giving at least `width` points
+# Params: sidecar_path: path of a sidecar folder, width: number of points wanted (e.g. pixels),
+#         start_frame/end_frame: optional range of samples within the recording
+# Returns: Tuple: (min, max, rms) int16 arrays and the number of samples summarised by each point
+def load_waveform(sidecar_path, width, start_frame=0, end_frame=None):
+    meta = _load_meta(sidecar_path)
+    if end_frame is None:
+        end_frame = meta["num_frames"]
+    if meta["wave_levels"] == 0:
+        empty = np.zeros(0, dtype=np.int16)
+        return empty, empty, empty, meta["wave_block"]
+
+    level, first, last = _choose_level(meta, "wave", width, start_frame, end_frame)
+
+    # Copy the slices out of the memory maps so that the files are not kept open
+    mins = np.array(_open_level(sidecar_path, f"wave_min_{level}")[first:last])
+    maxs = np.array(_open_level(sidecar_path, f"wave_max_{level}")[first:last])
+    rms = np.array(_open_level(sidecar_path, f"wave_rms_{level}")[first:last])
+    return mins, maxs, rms, meta["wave_block"] * meta["factor"] ** level
+
+
+# Loads the spectrogram columns covering start_frame to end_frame at the coarsest level giving at least `width` columns
+# Returns: Tuple: uint8 array of shape (columns, SPEC_BINS) and the number of samples summarised by each column.
+#          Values map linearly onto SPEC_DB_FLOOR - 0 dB relative to a full scale sine.
+def load_spectrogram(sidecar_path, width, start_frame=0, end_frame=None):
+    meta = _load_meta(sidecar_path)
+    if end_frame is None:
+        end_frame = meta["num_frames"]
+    if meta["spec_levels"] == 0:
+        return np.zeros((0, SPEC_BINS), dtype=np.uint8), meta["spec_hop"]
+
+    level, first, last = _choose_level(meta, "spec", width, start_frame, end_frame)
+
+    columns = np.array(_open_level(sidecar_path, f"spec_{level}")[first:last])
+    return columns, meta["spec_hop"] * meta["factor"] ** level
+
+
+if __name__ == "__main__":
+    # To use: python pyramid.py <session directory> [<session directory> ...]
+    if len(sys.argv) < 2:
+        print("Please specify one or more session directories.")
+        sys.exit(1)
+
+    for directory in sys.argv[1:]:
+        update_session(directory)
@@ -0,0 +1,72 @@
+#!/usr/bin/python3.9
+
+"""
+Tests for drift.py. Run with: python -m pytest
+"""
+
+import random
+
+import pytest
+
+from drift import ClockDriftEstimator, combined_rate, rate_to_ppm, is_plausible, correct_drift
+
+
+# Feeds an estimator the reads of a stream whose clock runs at true_rate, with up to jitter seconds of latency
+def simulate_stream(estimator, true_rate, start_time, seconds, jitter, rng):
+    for i in range(int(true_rate / 1024 * seconds)):
+        total_frames = (i + 1) * 1024
+        estimator.update(start_time + total_frames / true_rate + rng.uniform(0, jitter), total_frames)
+
+
+# The intercept of the fit gives the time capture started, independent of when the first read returned
+def test_time_of_first_frame():
+    rng = random.Random(0)
+    estimator = ClockDriftEstimator(96000)
+    simulate_stream(estimator, 96000 * (1 + 25e-6), 1000.0, 30, 0.002, rng)
+
+    assert abs(estimator.time_at_frames(0) - 1000.001) < 0.001
+    assert ClockDriftEstimator(96000).time_at_frames(0) is None
+
+
+# A sound card 37 ppm fast is measured to within a few ppm despite 2 ms of read latency jitter
+def test_drift_estimate():
+    rng = random.Random(1)
+    true_rate = 96000 * (1 + 37e-6)
+
+    estimators = []
+    for recording in range(3):
+        estimator = ClockDriftEstimator(96000)
+        simulate_stream(estimator, true_rate, 1000.0 * recording, 60, 0.002, rng)
+        estimators.append(estimator)
+        assert abs(estimator.drift_ppm - 37) < 5
+
+    # Pooling the recordings of a session gives a closer estimate than any single one
+    session_rate = combined_rate(estimators)
+    assert abs(rate_to_ppm(session_rate, 96000) - 37) < 2
+    assert is_plausible(session_rate, 96000)
+    assert not is_plausible(96000 * 1.01, 96000)
+
+
+# Reads during the warm up are ignored, so a single read gives no estimate
+def test_no_estimate_without_data():
+    estimator = ClockDriftEstimator(96000)
+    estimator.update(0.0, 1024)
+    assert estimator.rate is None
+    assert combined_rate([estimator]) is None
+
+
+# Resampling a sine captured by a fast clock gives the same sine sampled at the nominal rate
+def test_correct_drift():
+    np = pytest.importorskip("numpy")
+
+    true_rate = 96000 * (1 + 37e-6)
+    num_frames = 96000 * 20
+    captured = np.round(10000 * np.sin(2 * np.pi * 1000 * np.arange(num_frames) / true_rate)).astype("<i2")
+
+    corrected = np.frombuffer(correct_drift(captured.tobytes(), true_rate, 96000), dtype="<i2")
+    assert len(corrected) == int((num_frames - 1) / (true_rate / 96000)) + 1
+    # A clock 37 ppm fast captures 37 ppm more frames than the nominal rate in the same time
+    assert abs((num_frames - len(corrected)) - num_frames * 37e-6) <= 1
+
+    expected = 10000 * np.sin(2 * np.pi * 1000 * np.arange(len(corrected)) / 96000)
+    assert np.abs(corrected - expected).max() < 3
@@ -0,0 +1,146 @@
+#!/usr/bin/python3.9
+
+"""
+Tests for extract.py. Run with: python -m pytest
+"""
+
+import os
+import wave
+from datetime import datetime, timedelta
+
+from extract import extract_range, load_session_index, append_to_session_index, map_time_range
+
+
+# Writes a mono 16-bit .wav file whose samples count up from first_value
+def write_wav(path, num_frames, sample_rate, first_value=0):
+    with wave.open(path, 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(sample_rate)
+        wf.writeframes(b''.join((first_value + i).to_bytes(2, "little", signed=True) for i in range(num_frames)))
+
+
+# Reads the samples of a mono 16-bit .wav file as a list of ints
+def read_wav(path):
+    with wave.open(path, 'rb') as wf:
+        data = wf.readframes(wf.getnframes())
+    return [int.from_bytes(data[i:i + 2], "little", signed=True) for i in range(0, len(data), 2)]
+
+
+# Writes recordings to a session directory and lists them in its session.json
+# Params: recordings: list of (start datetime, number of frames, first sample value)
+def make_session(session_directory, recordings, sample_rate=1000):
+    for index, (start, num_frames, first_value) in enumerate(recordings, start=1):
+        file_name = f"output_{index}.wav"
+        write_wav(os.path.join(session_directory, file_name), num_frames, sample_rate, first_value)
+        append_to_session_index(session_directory, file_name, start, num_frames, sample_rate)
+
+
+# Sessions recorded before session.json existed are indexed from the times printed in the log
+def test_log_fallback(tmp_path):
+    session_directory = str(tmp_path)
+    write_wav(os.path.join(session_directory, "output_1.wav"), 10000, 1000)
+    write_wav(os.path.join(session_directory, "output_2.wav"), 10000, 1000, first_value=20000)
+
+    with open(os.path.join(session_directory, "default_log.txt"), "w") as log_file:
+        log_file.write("Recording complete.\n"
+                       "Current date and time: 2024-01-01 14:00:10\n"
+                       f"Recording saved as: {session_directory}/output_1.wav\n"
+                       "Recording complete.\n"
+                       "Current date and time: 2024-01-01 14:00:22\n"
+                       f"Recording saved as: {session_directory}/output_2.wav\n")
+
+    files = load_session_index(session_directory)
+    assert [entry["file"] for entry in files] == ["output_1.wav", "output_2.wav"]
+    assert files[0]["start_time"] == datetime(2024, 1, 1, 14, 0, 0)
+    assert files[1]["start_time"] == datetime(2024, 1, 1, 14, 0, 12)
+
+    output_path = os.path.join(session_directory, "extract.wav")
+    spans = extract_range(session_directory, "14:00:08", "14:00:13", output_path)
+    assert spans == [("output_1.wav", 8000, 10000), ("output_2.wav", 0, 1000)]
+
+    with wave.open(output_path, 'rb') as wf:
+        assert wf.getnframes() == 3000
+        data = wf.readframes(wf.getnframes())
+    assert int.from_bytes(data[:2], "little", signed=True) == 8000
+    assert int.from_bytes(data[4000:4002], "little", signed=True) == 20000
+
+
+# Frames covered by two overlapping recordings are only copied once, so output offsets still match absolute time
+def test_overlapping_recordings(tmp_path):
+    session_directory = str(tmp_path)
+    start = datetime(2024, 1, 1, 14, 0, 0)
+    make_session(session_directory, [(start, 5000, 0), (start + timedelta(seconds=4.8), 5000, 10000)])
+    output_path = os.path.join(session_directory, "extract.wav")
+
+    for fill_gaps in (False, True):
+        spans = extract_range(session_directory, "14:00:03", "14:00:06", output_path, fill_gaps=fill_gaps)
+        assert spans == [("output_1.wav", 3000, 5000), ("output_2.wav", 200, 1200)]
+
+        samples = read_wav(output_path)
+        assert len(samples) == 3000
+        assert samples[1999] == 4999
+        assert samples[2000] == 10200
+
+
+# Extraction across a file boundary using the start times in session.json
+def test_session_index(tmp_path):
+    session_directory = str(tmp_path)
+    start = datetime(2024, 1, 1, 14, 0, 0, 250000)
+    make_session(session_directory, [(start, 10000, 0), (start + timedelta(seconds=12), 10000, 20000)])
+
+    output_path = os.path.join(session_directory, "extract.wav")
+    spans = extract_range(session_directory, "14:00:08", "2024-01-01 14:00:14", output_path)
+    assert spans == [("output_1.wav", 7750, 10000), ("output_2.wav", 0, 1750)]
+
+    samples = read_wav(output_path)
+    assert len(samples) == 4000
+    assert samples[0] == 7750
+    assert samples[2249] == 9999
+    assert samples[2250] == 20000
+
+
+# With fill_gaps, silence before, between and after the recordings keeps output offsets equal to absolute time
+def test_fill_gaps(tmp_path):
+    session_directory = str(tmp_path)
+    start = datetime(2024, 1, 1, 14, 0, 0)
+    make_session(session_directory, [(start, 2000, 1), (start + timedelta(seconds=3), 2000, 10001)])
+
+    output_path = os.path.join(session_directory, "extract.wav")
+    extract_range(session_directory, "13:59:59", "14:00:06", output_path, fill_gaps=True)
+
+    samples = read_wav(output_path)
+    assert len(samples) == 7000
+    assert set(samples[:1000]) == {0}
+    assert samples[1000] == 1 and samples[2999] == 2000
+    assert set(samples[3000:4000]) == {0}
+    assert samples[4000] == 10001 and samples[5999] == 12000
+    assert set(samples[6000:]) == {0}
+
+    # Without fill_gaps the recordings are simply joined
+    extract_range(session_directory, "13:59:59", "14:00:06", output_path)
+    assert len(read_wav(output_path)) == 4000
+
+
+# Times without a date in a session crossing midnight refer to the following day
+def test_midnight_rollover(tmp_path):
+    session_directory = str(tmp_path)
+    make_session(session_directory, [(datetime(2024, 1, 1, 23, 59, 55), 10000, 0)])
+
+    output_path = os.path.join(session_directory, "extract.wav")
+    spans = extract_range(session_directory, "23:59:58", "00:00:02", output_path)
+    assert spans == [("output_1.wav", 3000, 7000)]
+    assert read_wav(output_path)[0] == 3000
+
+
+# Offsets are computed with the measured clock rate of the sound card rather than the nominal sample rate
+def test_clock_rate():
+    start = datetime(2024, 1, 1, 14, 0, 0)
+    files = [{"file": "output_1.wav", "start_time": start, "frames": 200000, "sample_rate": 1000, "clock_rate": 1001}]
+
+    spans = map_time_range(files, start + timedelta(seconds=100), start + timedelta(seconds=150))
+    assert [(first, last) for _, first, last in spans] == [(100100, 150150)]
+
+    files[0]["clock_rate"] = None
+    spans = map_time_range(files, start + timedelta(seconds=100), start + timedelta(seconds=150))
+    assert [(first, last) for _, first, last in spans] == [(100000, 150000)]
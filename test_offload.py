@@ -0,0 +1,95 @@
+#!/usr/bin/python3.9
+
+"""
+Tests for offload.py. Run with: python -m pytest
+"""
+
+import os
+import errno
+
+import offload as offload_module
+from offload import offload, copy_file, verify_offload, PART_SUFFIX, PART_INFO_SUFFIX
+
+
+# Writes a .part file holding the first part_size bytes of src_path, as an interrupted copy would leave it
+def write_part(src_path, dst_path, part_size):
+    data = open(src_path, 'rb').read()
+    with open(dst_path + PART_SUFFIX, 'wb') as f:
+        f.write(data[:part_size])
+    with open(dst_path + PART_INFO_SUFFIX, 'w') as f:
+        f.write('{"size": %d, "mtime": %d}' % (len(data), os.stat(src_path).st_mtime_ns))
+
+
+# A .part file left behind by a different source must not be resumed, even without verification
+def test_stale_part_is_not_resumed(tmp_path):
+    source = tmp_path / "card"
+    target = tmp_path / "offload"
+    (source / "loc_20240101_120000").mkdir(parents=True)
+    (target / "loc_20240101_120000").mkdir(parents=True)
+
+    (source / "loc_20240101_120000" / "output_1.wav").write_bytes(b"A" * 1000)
+    (target / "loc_20240101_120000" / ("output_1.wav" + PART_SUFFIX)).write_bytes(b"Z" * 400)
+
+    assert offload(str(source), str(target), workers=1, verify=False) == []
+    assert (target / "loc_20240101_120000" / "output_1.wav").read_bytes() == b"A" * 1000
+    assert verify_offload(str(target)) == []
+
+
+# A .part file copied from the same version of the source is resumed and the result verified
+def test_interrupted_copy_resumes(tmp_path):
+    source = tmp_path / "card"
+    target = tmp_path / "offload"
+    (source / "loc_20240101_120000").mkdir(parents=True)
+    (target / "loc_20240101_120000").mkdir(parents=True)
+
+    data = os.urandom(100000)
+    src_path = source / "loc_20240101_120000" / "output_1.wav"
+    src_path.write_bytes(data)
+
+    dst_path = target / "loc_20240101_120000" / "output_1.wav"
+    write_part(str(src_path), str(dst_path), 30000)
+
+    assert offload(str(source), str(target), workers=1) == []
+    assert dst_path.read_bytes() == data
+    assert not os.path.exists(str(dst_path) + PART_INFO_SUFFIX)
+    assert verify_offload(str(target)) == []
+
+
+# Without copy_file_range, a resumed copy must continue at the end of the .part file, not overwrite its start
+def test_resume_with_sendfile_only(tmp_path, monkeypatch):
+    monkeypatch.delattr(os, "copy_file_range", raising=False)
+
+    data = os.urandom(200000)
+    src_path = str(tmp_path / "output_1.wav")
+    dst_path = str(tmp_path / "copy" / "output_1.wav")
+    open(src_path, 'wb').write(data)
+    os.makedirs(os.path.dirname(dst_path))
+    write_part(src_path, dst_path, 50000)
+
+    assert copy_file(src_path, dst_path, len(data), verify=False) is None
+    assert open(dst_path, 'rb').read() == data
+
+
+# Across filesystems copy_file_range fails with EXDEV, and the copy should go on with sendfile
+def test_cross_device_copy_uses_sendfile(tmp_path, monkeypatch):
+    def copy_file_range(*args):
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+    sendfile_calls = []
+    real_sendfile = os.sendfile
+
+    def sendfile(*args):
+        sendfile_calls.append(args)
+        return real_sendfile(*args)
+
+    monkeypatch.setattr(offload_module.os, "copy_file_range", copy_file_range, raising=False)
+    monkeypatch.setattr(offload_module.os, "sendfile", sendfile)
+
+    data = os.urandom(100000)
+    src_path = str(tmp_path / "output_1.wav")
+    dst_path = str(tmp_path / "copy" / "output_1.wav")
+    open(src_path, 'wb').write(data)
+
+    copy_file(src_path, dst_path, len(data), verify=False)
+    assert sendfile_calls
+    assert open(dst_path, 'rb').read() == data
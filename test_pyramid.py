@@ -0,0 +1,102 @@
+#!/usr/bin/python3.9
+
+"""
+Tests for pyramid.py. Run with: python -m pytest
+"""
+
+import os
+import wave
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import pyramid
+
+SAMPLE_RATE = 96000
+
+# 7 seconds plus a partial block, so that the last point of every level covers fewer samples than the others
+NUM_FRAMES = SAMPLE_RATE * 7 + 123
+
+
+# Writes a 1 kHz sine with an amplitude of 20000 to a mono 16-bit .wav file
+def write_sine(path, num_frames=NUM_FRAMES):
+    t = np.arange(num_frames) / SAMPLE_RATE
+    samples = np.round(20000 * np.sin(2 * np.pi * 1000 * t)).astype("<i2")
+
+    with wave.open(path, 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(SAMPLE_RATE)
+        wf.writeframes(samples.tobytes())
+
+
+# Every waveform level summarises the whole sine, including the ragged last group
+def test_waveform_levels(tmp_path):
+    wav_path = str(tmp_path / "output_1.wav")
+    write_sine(wav_path)
+    sidecar_path = pyramid.build_pyramid(wav_path)
+
+    meta = pyramid._load_meta(sidecar_path)
+    assert meta["num_frames"] == NUM_FRAMES
+    assert meta["wave_levels"] == 6
+
+    expected_points = -(-NUM_FRAMES // pyramid.WAVE_BLOCK)
+    for level in range(meta["wave_levels"]):
+        mins = pyramid._open_level(sidecar_path, f"wave_min_{level}")
+        maxs = pyramid._open_level(sidecar_path, f"wave_max_{level}")
+        rms = pyramid._open_level(sidecar_path, f"wave_rms_{level}")
+
+        assert len(mins) == len(maxs) == len(rms) == expected_points
+        assert mins.min() == -20000 and maxs.max() == 20000
+        # The RMS of a sine is its amplitude / sqrt(2), also for the shorter last point of each level
+        assert np.all(np.abs(rms.astype(np.float64) - 20000 / np.sqrt(2)) < 150)
+
+        expected_points = -(-expected_points // pyramid.PYRAMID_FACTOR)
+
+    assert expected_points == 1
+
+
+# The spectrogram puts the energy of the sine in the band containing 1 kHz
+def test_spectrogram_levels(tmp_path):
+    wav_path = str(tmp_path / "output_1.wav")
+    write_sine(wav_path)
+    sidecar_path = pyramid.build_pyramid(wav_path)
+
+    columns, samples_per_column = pyramid.load_spectrogram(sidecar_path, 20)
+    band = int(1000 / (SAMPLE_RATE / 2) * pyramid.SPEC_BINS)
+    assert columns.shape[1] == pyramid.SPEC_BINS
+    assert samples_per_column == pyramid.SPEC_HOP * pyramid.PYRAMID_FACTOR
+    assert np.all(columns.argmax(axis=1) == band)
+
+
+# load_waveform picks the coarsest level with enough points and slices out the requested range
+def test_load_waveform(tmp_path):
+    wav_path = str(tmp_path / "output_1.wav")
+    write_sine(wav_path)
+    sidecar_path = pyramid.build_pyramid(wav_path)
+
+    mins, maxs, rms, samples_per_point = pyramid.load_waveform(sidecar_path, 100)
+    assert samples_per_point == 4096
+    assert len(mins) == len(maxs) == len(rms) == 165
+
+    mins, maxs, rms, samples_per_point = pyramid.load_waveform(sidecar_path, 10, SAMPLE_RATE, 2 * SAMPLE_RATE)
+    assert samples_per_point == 4096
+    assert len(mins) == 2 * SAMPLE_RATE // 4096 + 1 - SAMPLE_RATE // 4096
+
+
+# update_session only builds missing or outdated sidecars and carries on past unreadable files
+def test_update_session(tmp_path):
+    session_directory = str(tmp_path)
+    write_sine(os.path.join(session_directory, "output_1.wav"))
+    write_sine(os.path.join(session_directory, "output_2.wav"), 5000)
+    with open(os.path.join(session_directory, "output_3.wav"), 'wb') as f:
+        f.write(b"not a wav file")
+
+    built = pyramid.update_session(session_directory)
+    assert [os.path.basename(p) for p in built] == ["output_1", "output_2"]
+    assert pyramid.update_session(session_directory) == []
+
+    write_sine(os.path.join(session_directory, "output_2.wav"), 6000)
+    built = pyramid.update_session(session_directory)
+    assert [os.path.basename(p) for p in built] == ["output_2"]